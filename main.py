@@ -361,6 +361,8 @@ if __name__ == '__main__':
 
 
 
+    if 'int8' in flag and model_name in ['MMOE_MT','MMOE_MT_ATT']:
+        model.quantize_embedding()
     pred_ans = model.predict(test_model_input, batch_size * 4)
 
     test_auc_list = []
@@ -8,7 +8,7 @@ Reference:
 """
 import torch
 import torch.nn as nn
-from .satrans import SelfAttention_Layer
+from .satrans import SelfAttention_Layer,GroupedDNN
 from .mtl_basemodel import BaseModel
 from deepctr_torch.inputs import combined_dnn_input
 from deepctr_torch.layers import DNN, PredictionLayer
@@ -80,9 +80,9 @@ class MMOE(BaseModel):
 
 
         # expert dnn
-        self.expert_dnn = nn.ModuleList([DNN(self.input_dim, expert_dnn_hidden_units, activation=dnn_activation,
-                                             l2_reg=l2_reg_dnn, dropout_rate=dnn_dropout, use_bn=dnn_use_bn,
-                                             init_std=init_std, device=device) for _ in range(self.num_experts)])
+        self.expert_dnn = GroupedDNN(self.input_dim, expert_dnn_hidden_units, self.num_experts,
+                                     activation=dnn_activation, l2_reg=l2_reg_dnn, dropout_rate=dnn_dropout,
+                                     use_bn=dnn_use_bn, init_std=init_std, device=device)
 
         # gate dnn
         if len(gate_dnn_hidden_units) > 0:
@@ -140,11 +140,7 @@ class MMOE(BaseModel):
 
 
         # expert dnn
-        expert_outs = []
-        for i in range(self.num_experts):
-            expert_out = self.expert_dnn[i](dnn_input)
-            expert_outs.append(expert_out)
-        expert_outs = torch.stack(expert_outs, 1)  # (bs, num_experts, dim)
+        expert_outs = self.expert_dnn(dnn_input)  # (bs, num_experts, dim)
 
         # gate dnn
         mmoe_outs = []
@@ -154,8 +150,8 @@ class MMOE(BaseModel):
                 gate_dnn_out = self.gate_dnn_final_layer[i](gate_dnn_out)
             else:
                 gate_dnn_out = self.gate_dnn_final_layer[i](dnn_input)
-            gate_mul_expert = torch.matmul(gate_dnn_out.softmax(1).unsqueeze(1), expert_outs)  # (bs, 1, dim)
-            mmoe_outs.append(gate_mul_expert.squeeze())
+            gate_mul_expert = torch.einsum('be,bed->bd', gate_dnn_out.softmax(-1), expert_outs)  # (bs, dim)
+            mmoe_outs.append(gate_mul_expert)
 
         # tower dnn (task-specific)
         task_outs = []
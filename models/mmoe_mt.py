@@ -8,9 +8,9 @@ Reference:
 """
 import torch
 import torch.nn as nn
-from .satrans import SelfAttention_Layer
+from contextlib import nullcontext
+from .satrans import SelfAttention_Layer,GroupedLinear,GroupedDNN,softmax_routing,gated_grouped_logit
 from .mtl_basemodel import BaseModel
-from deepctr_torch.inputs import combined_dnn_input
 from deepctr_torch.layers import DNN, PredictionLayer
 import torch.nn.functional as F
 
@@ -75,41 +75,40 @@ class MMOE_MT(BaseModel):
         self.expert_dnn_hidden_units = expert_dnn_hidden_units
         self.gate_dnn_hidden_units = gate_dnn_hidden_units
         self.tower_dnn_hidden_units = tower_dnn_hidden_units
-        if 'usetrans' in self.flag:
-            self.int_layers = nn.ModuleList(
-                [SelfAttention_Layer(self.embedding_dim, 4, True, device=device) for _ in range(3)])
+        self._use_trans = 'usetrans' in (self.flag or '')
+        if self._use_trans:
+            self.int_layers = nn.Sequential(
+                *[SelfAttention_Layer(self.embedding_dim, 4, True, device=device) for _ in range(3)])
 
 
         # expert dnn
-        self.expert_dnn = nn.ModuleList([DNN(self.input_dim, expert_dnn_hidden_units, activation=dnn_activation,
-                                             l2_reg=l2_reg_dnn, dropout_rate=dnn_dropout, use_bn=dnn_use_bn,
-                                             init_std=init_std, device=device) for _ in range(self.num_experts)])
+        self.expert_dnn = GroupedDNN(self.input_dim, expert_dnn_hidden_units, self.num_experts,
+                                     activation=dnn_activation, l2_reg=l2_reg_dnn, dropout_rate=dnn_dropout,
+                                     use_bn=dnn_use_bn, init_std=init_std, device=device)
 
         # gate dnn
         if len(gate_dnn_hidden_units) > 0:
-            self.gate_dnn = nn.ModuleList([DNN(self.input_dim, gate_dnn_hidden_units, activation=dnn_activation,
-                                               l2_reg=l2_reg_dnn, dropout_rate=dnn_dropout, use_bn=dnn_use_bn,
-                                               init_std=init_std, device=device) for _ in range(self.num_tasks)])
+            self.gate_dnn = GroupedDNN(self.input_dim, gate_dnn_hidden_units, self.num_tasks,
+                                       activation=dnn_activation, l2_reg=l2_reg_dnn, dropout_rate=dnn_dropout,
+                                       use_bn=dnn_use_bn, init_std=init_std, device=device)
             self.add_regularization_weight(
                 filter(lambda x: 'weight' in x[0] and 'bn' not in x[0], self.gate_dnn.named_parameters()),
                 l2=l2_reg_dnn)
-        self.gate_dnn_final_layer = nn.ModuleList(
-            [nn.Linear(gate_dnn_hidden_units[-1] if len(gate_dnn_hidden_units) > 0 else self.input_dim,
-                       self.num_experts, bias=False) for _ in range(self.num_tasks)])
+        self.gate_dnn_final_layer = GroupedLinear(
+            gate_dnn_hidden_units[-1] if len(gate_dnn_hidden_units) > 0 else self.input_dim,
+            self.num_experts, self.num_tasks, bias=False, device=device)
 
         # tower dnn (task-specific)
         if len(tower_dnn_hidden_units) > 0:
-            self.tower_dnn = nn.ModuleList(
-                [DNN(expert_dnn_hidden_units[-1], tower_dnn_hidden_units, activation=dnn_activation,
-                     l2_reg=l2_reg_dnn, dropout_rate=dnn_dropout, use_bn=dnn_use_bn,
-                     init_std=init_std, device=device) for _ in range(self.num_tasks)])
+            self.tower_dnn = GroupedDNN(expert_dnn_hidden_units[-1], tower_dnn_hidden_units, self.num_tasks,
+                                        activation=dnn_activation, l2_reg=l2_reg_dnn, dropout_rate=dnn_dropout,
+                                        use_bn=dnn_use_bn, init_std=init_std, device=device)
             self.add_regularization_weight(
                 filter(lambda x: 'weight' in x[0] and 'bn' not in x[0], self.tower_dnn.named_parameters()),
                 l2=l2_reg_dnn)
-        self.tower_dnn_final_layer = nn.ModuleList([nn.Linear(
+        self.tower_dnn_final_layer = GroupedLinear(
             tower_dnn_hidden_units[-1] if len(tower_dnn_hidden_units) > 0 else expert_dnn_hidden_units[-1], 1,
-            bias=False)
-                                                    for _ in range(self.num_tasks)])
+            self.num_tasks, bias=False, device=device)
 
         self.out = nn.ModuleList([PredictionLayer(task) for task in task_types])
 
@@ -117,7 +116,6 @@ class MMOE_MT(BaseModel):
         for module in regularization_modules:
             self.add_regularization_weight(
                 filter(lambda x: 'weight' in x[0] and 'bn' not in x[0], module.named_parameters()), l2=l2_reg_dnn)
-        self.to(device)
         #domain
         if domain_id_as_feature:
             field_num = len(self.embedding_dict)
@@ -125,79 +123,101 @@ class MMOE_MT(BaseModel):
             dnn_feature_columns = self.filter_feature_columns(dnn_feature_columns, domain_column)
             field_num = len(self.embedding_dict) - 1
         self.domain_column = domain_column
+        self._domain_col_idx = self.feature_index[domain_column][0]
         embedding_size = self.embedding_size
         # print('num_domains',num_domains)
         self.domain_embeddings = nn.Embedding(num_domains+1, embedding_size)
-        self.lhuc = nn.ModuleList([
+        self.lhuc = nn.Sequential(
                         nn.Linear(embedding_size, 128, bias=False),
-                        nn.ReLU(),
+                        nn.ReLU(inplace=True),
                         nn.Linear(128, 64, bias=False),
                         nn.Sigmoid()
-                    ])
+                    )
+        self.fuse_sparse_embedding()
         self.to(device)
-    def forward(self, X):
-        sparse_embedding_list, dense_value_list = self.input_from_feature_columns(X, self.dnn_feature_columns,
-                                                                                  self.embedding_dict)
-        #dnn_input = combined_dnn_input(sparse_embedding_list, dense_value_list)
-
-
-        if 'usetrans' in self.flag:
-            att_input = concat_fun(sparse_embedding_list, axis=1)
-            for layer in self.int_layers:
-                att_input = layer(att_input)
-            att_output = torch.flatten(att_input, start_dim=1)
-            if len(dense_value_list)>0:
-                dense_input = concat_fun(dense_value_list, axis=1)
-                dnn_input = concat_fun([att_output, dense_input])
-            else:
-                dnn_input=att_output
+        # bf16 autocast of the expert/gate/LHUC/tower stack, applied in training and, if amp_infer is set, in eval
+        self.use_bf16 = 'bf16' in (self.flag or '')
+        self.amp_infer = False
+        self.amp_device_type = torch.device(device).type
+        # compiled versions of the unbound functions, called with the module as first argument:
+        # a bound method stored on the instance would be copied to DataParallel replicas still bound to self
+        self._compiled_core = None
+        self._compiled_int_layers = None
+        if 'compile' in (self.flag or ''):
+            if not hasattr(torch, 'compile'):
+                raise ValueError("'compile' in flag requires torch>=2.0, got torch {}".format(torch.__version__))
+            self._compiled_core = torch.compile(type(self)._forward_core)
+            if self._use_trans:
+                self._compiled_int_layers = torch.compile(nn.Sequential.forward)
 
+    def forward(self, X):
+        # the flag string is resolved once in __init__, only a bool is tested per call
+        if self._use_trans:
+            return self._forward_trans(X)
+        return self._forward_notrans(X)
+
+    def _forward_trans(self, X):
+        sparse_embedding, dense_value_list = self.input_from_fused_embedding(X)  # (bs, field_num, embedding_size)
+        if self._compiled_int_layers is not None:
+            att_input = self._compiled_int_layers(self.int_layers, sparse_embedding)
         else:
-            dnn_input = combined_dnn_input(sparse_embedding_list, dense_value_list)
+            att_input = self.int_layers(sparse_embedding)
+        att_output = torch.flatten(att_input, start_dim=1)
+        # a single cat with the dense values, no intermediate dense concat
+        dnn_input = concat_fun([att_output] + dense_value_list, axis=1)
+        return self._forward_dnn_input(X, dnn_input)
+
+    def _forward_notrans(self, X):
+        sparse_embedding, dense_value_list = self.input_from_fused_embedding(X)  # (bs, field_num, embedding_size)
+        # same layout as combined_dnn_input, built with one cat instead of three
+        dnn_input = concat_fun([torch.flatten(sparse_embedding, start_dim=1)] + dense_value_list, axis=1)
+        return self._forward_dnn_input(X, dnn_input)
+
+    def _forward_dnn_input(self, X, dnn_input):
+        domain_ids = X[:, self._domain_col_idx]
+        if domain_ids.dtype != torch.long:
+            domain_ids = domain_ids.long()
+        # the autocast context is only built when bf16 is on, the default path never touches it
+        if self.use_bf16 and (self.training or self.amp_infer):
+            amp = torch.autocast(self.amp_device_type, dtype=torch.bfloat16)
+        else:
+            amp = nullcontext()
+        with amp:
+            if self._compiled_core is not None:
+                return self._compiled_core(self, dnn_input, domain_ids)
+            return self._forward_core(dnn_input, domain_ids)
 
+    def _forward_core(self, dnn_input, domain_ids):
+        # tensor-only part of the forward, compiled as a whole when 'compile' is in flag
 
         # expert dnn
-        expert_outs = []
-        for i in range(self.num_experts):
-            expert_out = self.expert_dnn[i](dnn_input)
-            expert_outs.append(expert_out)
-        expert_outs = torch.stack(expert_outs, 1)  # (bs, num_experts, dim)
+        expert_outs = self.expert_dnn(dnn_input)  # (bs, num_experts, dim)
 
         # gate dnn
-        mmoe_outs = []
-        for i in range(self.num_tasks):
-            if len(self.gate_dnn_hidden_units) > 0:
-                gate_dnn_out = self.gate_dnn[i](dnn_input)
-                gate_dnn_out = self.gate_dnn_final_layer[i](gate_dnn_out)
-            else:
-                gate_dnn_out = self.gate_dnn_final_layer[i](dnn_input)
-            gate_mul_expert = torch.matmul(gate_dnn_out.softmax(1).unsqueeze(1), expert_outs)  # (bs, 1, dim)
-            mmoe_outs.append(gate_mul_expert.squeeze())
+        if len(self.gate_dnn_hidden_units) > 0:
+            gate_dnn_out = self.gate_dnn(dnn_input)
+            gate_dnn_out = self.gate_dnn_final_layer(gate_dnn_out)
+        else:
+            gate_dnn_out = self.gate_dnn_final_layer(dnn_input)  # (bs, num_tasks, num_experts)
+        mmoe_outs = softmax_routing(gate_dnn_out, expert_outs)  # (bs, num_tasks, dim)
 
         # domain
 
-        domain_ids = X[:, self.feature_index[self.domain_column][0]].long().to(self.device)
         domain_emb = self.domain_embeddings(domain_ids)
         # print("domain_emb",domain_emb.shape)
-        lhuc_output = domain_emb
-        for layer in self.lhuc:
-            lhuc_output = layer(lhuc_output)
-        lhuc_output = lhuc_output*2
+        lhuc_output = self.lhuc(domain_emb)*2
         # print("lhuc_output",lhuc_output.shape)
 
         # tower dnn (task-specific)
-        task_outs = []
-        for i in range(self.num_tasks):
-            if len(self.tower_dnn_hidden_units) > 0:
-                tower_dnn_out = self.tower_dnn[i](mmoe_outs[i])
-                # print(f"task:{i},tower_dnn_out:{tower_dnn_out.shape}")
-                tower_dnn_out = tower_dnn_out*lhuc_output
-                tower_dnn_logit = self.tower_dnn_final_layer[i](tower_dnn_out)
-            else:
-                tower_dnn_logit = self.tower_dnn_final_layer[i](mmoe_outs[i])
-            output = self.out[i](tower_dnn_logit)
-            task_outs.append(output)
-        task_outs = torch.cat(task_outs, -1)
+        if len(self.tower_dnn_hidden_units) > 0:
+            tower_dnn_out = self.tower_dnn(mmoe_outs)  # (bs, num_tasks, dim)
+            tower_dnn_logit = gated_grouped_logit(tower_dnn_out, lhuc_output.unsqueeze(1),
+                                                  self.tower_dnn_final_layer.weight)
+        else:
+            tower_dnn_logit = self.tower_dnn_final_layer(mmoe_outs)  # (bs, num_tasks, 1)
+        # prediction layers always run in fp32
+        tower_dnn_logit = tower_dnn_logit.float()
+        task_outs = torch.cat([self.out[i](tower_dnn_logit[:, i]) for i in range(self.num_tasks)], -1)
         # print("task_outs",task_outs.shape)
         return task_outs
     def filter_feature_columns(self, feature_columns, filtered_col_names):
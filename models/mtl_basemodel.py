@@ -9,6 +9,7 @@ Author:
 from __future__ import print_function
 
 import time
+from collections import OrderedDict
 
 import numpy as np
 import torch
@@ -29,6 +30,7 @@ from deepctr_torch.inputs import build_input_features, SparseFeat, DenseFeat, Va
 from deepctr_torch.layers import PredictionLayer
 from deepctr_torch.layers.utils import slice_arrays
 from deepctr_torch.callbacks import History
+from .submodules import QuantizedEmbedding
 
 
 
@@ -236,6 +238,8 @@ class BaseModel(nn.Module):
             callbacks.__setattr__('model', self)
         callbacks.model.stop_training = False
 
+        domain_col_idx = self.feature_index[self.domain_column][0]
+
         # Train
         print("Train on {0} samples, validate on {1} samples, {2} steps per epoch".format(
             len(train_tensor_data), len(val_y), steps_per_epoch))
@@ -252,14 +256,15 @@ class BaseModel(nn.Module):
                 with tqdm(enumerate(train_loader), disable=verbose != 1, total=steps_per_epoch,
                             desc='Epoch {}/{}'.format(epoch + 1, epochs)) as t:
                     for _, (x_train, y_train) in t:
-                        x = x_train.to(self.device).float()
-                        y = y_train.to(self.device).float()
+                        # one transfer+cast per tensor instead of a copy followed by .float()
+                        x = x_train.to(self.device, dtype=torch.float32)
+                        y = y_train.to(self.device, dtype=torch.float32)
 
-                        domain_ids = x[:, self.feature_index[self.domain_column][0]].long()
+                        domain_ids = x[:, domain_col_idx].long()
 
                         y_pred = model(x).squeeze()
 
-                        optim.zero_grad()
+                        optim.zero_grad(set_to_none=True)
                         if isinstance(loss_func, list):
                             assert len(loss_func) == self.num_tasks,\
                                 "the length of `loss_func` should be equal with `self.num_tasks`"
@@ -366,11 +371,13 @@ class BaseModel(nn.Module):
         test_loader = DataLoader(
             dataset=tensor_data, shuffle=False, batch_size=batch_size)
 
+        domain_col_idx = self.feature_index[self.domain_column][0]
         pred_ans = []
         with torch.no_grad():
             for _, x_test in enumerate(test_loader):
-                x = x_test[0].to(self.device).float()
-                domain_ids = x[:, self.feature_index[self.domain_column][0]].long().cpu().numpy()
+                x = x_test[0].to(self.device, dtype=torch.float32)
+                # read the domain ids from the host batch, no device round trip
+                domain_ids = x_test[0][:, domain_col_idx].long().numpy()
 
                 y_pred = model(x).cpu().data.numpy()  # .squeeze()
 
@@ -411,6 +418,70 @@ class BaseModel(nn.Module):
 
         return sparse_embedding_list + varlen_sparse_embedding_list, dense_value_list
 
+    def fuse_sparse_embedding(self):
+        """Merge the per-feature tables of ``embedding_dict`` into the single table ``fused_embedding``, so that
+        ``input_from_fused_embedding`` looks up all sparse features with one gather. Features sharing an
+        ``embedding_name`` keep sharing rows. Nothing is fused when the model has VarLenSparseFeat columns.
+        """
+        sparse_feature_columns = list(
+            filter(lambda x: isinstance(x, SparseFeat), self.dnn_feature_columns)) if len(
+            self.dnn_feature_columns) else []
+        varlen_sparse_feature_columns = list(
+            filter(lambda x: isinstance(x, VarLenSparseFeat), self.dnn_feature_columns)) if len(
+            self.dnn_feature_columns) else []
+        if len(sparse_feature_columns) == 0 or len(varlen_sparse_feature_columns) > 0:
+            self.fused_embedding = None
+            return
+
+        embedding_offsets = OrderedDict()
+        offset = 0
+        for feat in sparse_feature_columns:
+            if feat.embedding_name not in embedding_offsets:
+                embedding_offsets[feat.embedding_name] = offset
+                offset += self.embedding_dict[feat.embedding_name].num_embeddings
+
+        self.fused_embedding = nn.Embedding(offset, self.embedding_size)
+        self.fused_embedding.weight.data.copy_(
+            torch.cat([self.embedding_dict[name].weight.data for name in embedding_offsets], dim=0))
+        self.register_buffer('sparse_feature_index', torch.tensor(
+            [self.feature_index[feat.name][0] for feat in sparse_feature_columns], dtype=torch.long), persistent=False)
+        self.register_buffer('sparse_feature_offsets', torch.tensor(
+            [embedding_offsets[feat.embedding_name] for feat in sparse_feature_columns], dtype=torch.long),
+                             persistent=False)
+
+        # the fused table takes over the regularization of the per-feature tables
+        embedding_params = set(map(id, self.embedding_dict.parameters()))
+        self.regularization_weight = [
+            ([self.fused_embedding.weight], l1, l2) if any(id(w) in embedding_params for w in weight_list) else
+            (weight_list, l1, l2) for weight_list, l1, l2 in self.regularization_weight]
+        del self.embedding_dict
+
+    def quantize_embedding(self):
+        """Replace ``fused_embedding`` by an int8 copy with per-row scales, quartering the memory traffic of the
+        sparse lookup. Meant for inference after training: the quantized table is not trainable.
+        """
+        if getattr(self, 'fused_embedding', None) is None:
+            raise ValueError("quantize_embedding requires the fused sparse embedding, call fuse_sparse_embedding first")
+        self.fused_embedding = QuantizedEmbedding.from_float(self.fused_embedding)
+
+    def input_from_fused_embedding(self, X):
+        """
+        :return: sparse embeddings stacked as (bs, num_sparse_features, embedding_dim) and the list of dense values.
+        """
+        if self.fused_embedding is None:
+            sparse_embedding_list, dense_value_list = self.input_from_feature_columns(X, self.dnn_feature_columns,
+                                                                                      self.embedding_dict)
+            return torch.cat(sparse_embedding_list, dim=1), dense_value_list
+
+        dense_feature_columns = list(
+            filter(lambda x: isinstance(x, DenseFeat), self.dnn_feature_columns)) if len(
+            self.dnn_feature_columns) else []
+        dense_value_list = [X[:, self.feature_index[feat.name][0]:self.feature_index[feat.name][1]] for feat in
+                            dense_feature_columns]
+
+        sparse_index = X[:, self.sparse_feature_index].long() + self.sparse_feature_offsets
+        return self.fused_embedding(sparse_index), dense_value_list
+
     def compute_input_dim(self, feature_columns, include_sparse=True, include_dense=True, feature_group=False):
         sparse_feature_columns = list(
             filter(lambda x: isinstance(x, (SparseFeat, VarLenSparseFeat)), feature_columns)) if len(
@@ -190,8 +190,8 @@ class PLE(BaseModel):
                 gate_dnn_out = self.specific_gate_dnn_final_layer[level_num][i](gate_dnn_out)
             else:
                 gate_dnn_out = self.specific_gate_dnn_final_layer[level_num][i](inputs[i])
-            gate_mul_expert = torch.matmul(gate_dnn_out.softmax(1).unsqueeze(1), cur_experts_outputs)  # (bs, 1, dim)
-            cgc_outs.append(gate_mul_expert.squeeze())
+            gate_mul_expert = torch.einsum('be,bed->bd', gate_dnn_out.softmax(-1), cur_experts_outputs)  # (bs, dim)
+            cgc_outs.append(gate_mul_expert)
 
         # gates for shared experts
         cur_experts_outputs = specific_expert_outputs + shared_expert_outputs
@@ -202,8 +202,8 @@ class PLE(BaseModel):
             gate_dnn_out = self.shared_gate_dnn_final_layer[level_num](gate_dnn_out)
         else:
             gate_dnn_out = self.shared_gate_dnn_final_layer[level_num](inputs[-1])
-        gate_mul_expert = torch.matmul(gate_dnn_out.softmax(1).unsqueeze(1), cur_experts_outputs)  # (bs, 1, dim)
-        cgc_outs.append(gate_mul_expert.squeeze())
+        gate_mul_expert = torch.einsum('be,bed->bd', gate_dnn_out.softmax(-1), cur_experts_outputs)  # (bs, dim)
+        cgc_outs.append(gate_mul_expert)
 
         return cgc_outs
 
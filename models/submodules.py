@@ -61,6 +61,141 @@ class DNN_v2(nn.Module):#final layer without activation function
         return deep_input
 
 
+class GroupedLinear(nn.Module):
+    """num_groups independent Linear layers computed with a single einsum.
+    Input is either shared by all groups (bs, in) or per-group (bs, num_groups, in); output is (bs, num_groups, out)."""
+    def __init__(self, in_features, out_features, num_groups, bias=True, device='cpu'):
+        super(GroupedLinear, self).__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.num_groups = num_groups
+        self.weight = nn.Parameter(torch.Tensor(num_groups, in_features, out_features))
+        if bias:
+            self.bias = nn.Parameter(torch.Tensor(num_groups, out_features))
+        else:
+            self.register_parameter('bias', None)
+        # same default init as nn.Linear, applied group by group
+        bound = 1 / in_features ** 0.5
+        nn.init.uniform_(self.weight, -bound, bound)
+        if self.bias is not None:
+            nn.init.uniform_(self.bias, -bound, bound)
+
+        self.to(device)
+
+    def forward(self, inputs):
+        if inputs.dim() == 2:
+            output = torch.einsum('bi,gio->bgo', inputs, self.weight)
+        else:
+            output = torch.einsum('bgi,gio->bgo', inputs, self.weight)
+        if self.bias is not None:
+            # cast like nn.Linear does under autocast, otherwise the fp32 bias promotes a bf16 output back to fp32
+            output = output + self.bias.to(output.dtype)
+        return output
+
+
+class GroupedDNN(nn.Module):#num_groups DNNs with identical structure, one grouped GEMM per layer
+    def __init__(self, inputs_dim, hidden_units, num_groups, activation='relu', l2_reg=0, dropout_rate=0,
+                 use_bn=False, init_std=0.0001, dice_dim=3, seed=1024, device='cpu'):
+        super(GroupedDNN, self).__init__()
+        self.dropout_rate = dropout_rate
+        self.dropout = nn.Dropout(dropout_rate)
+        self.seed = seed
+        self.l2_reg = l2_reg
+        self.use_bn = use_bn
+        self.num_groups = num_groups
+        if len(hidden_units) == 0:
+            raise ValueError("hidden_units is empty!!")
+        hidden_units = [inputs_dim] + list(hidden_units)
+
+        self.linears = nn.ModuleList(
+            [GroupedLinear(hidden_units[i], hidden_units[i + 1], num_groups) for i in range(len(hidden_units) - 1)])
+
+        if self.use_bn:
+            # one BatchNorm1d over (num_groups * units) keeps the statistics of every group separate
+            self.bn = nn.ModuleList(
+                [nn.BatchNorm1d(num_groups * hidden_units[i + 1]) for i in range(len(hidden_units) - 1)])
+
+        self.activation_layers = nn.ModuleList(
+            [activation_layer(activation, hidden_units[i + 1], dice_dim) for i in range(len(hidden_units) - 1)])
+
+        for name, tensor in self.linears.named_parameters():
+            if 'weight' in name:
+                nn.init.normal_(tensor, mean=0, std=init_std)
+
+        self.to(device)
+
+    def forward(self, inputs):#inputs (bs, in) shared by all groups or (bs, num_groups, in)
+        deep_input = inputs
+
+        for i in range(len(self.linears)):
+
+            fc = self.linears[i](deep_input)
+
+            if self.use_bn:
+                fc = self.bn[i](fc.reshape(fc.shape[0], -1)).view_as(fc)
+
+            fc = self.activation_layers[i](fc)
+
+            fc = self.dropout(fc)
+            deep_input = fc
+        return deep_input#(bs, num_groups, hidden_units[-1])
+
+
+try:
+    from torch.compiler import is_compiling as _is_compiling
+except ImportError:
+    try:
+        from torch._dynamo import is_compiling as _is_compiling
+    except ImportError:# torch<2.0, nothing is ever compiled
+        def _is_compiling():
+            return False
+
+
+def softmax_routing(gate_logits, expert_outs):
+    # gate_logits (bs, num_tasks, num_experts), expert_outs (bs, num_experts, dim) -> (bs, num_tasks, dim)
+    # softmax in fp32, mixing in the dtype of the experts (bf16 under autocast)
+    gate = F.softmax(gate_logits, dim=-1, dtype=torch.float32).to(expert_outs.dtype)
+    if _is_compiling():
+        # broadcast multiply-sum, which torch.compile fuses with the softmax into one kernel
+        return (gate.unsqueeze(-1) * expert_outs.unsqueeze(1)).sum(dim=2)
+    # eagerly the broadcast materializes (bs, num_tasks, num_experts, dim), a batched matmul does not
+    return torch.einsum('bte,bed->btd', gate, expert_outs)
+
+
+def gated_grouped_logit(inputs, gate, weight):
+    # bias-free GroupedLinear with a single output applied to inputs * gate:
+    # inputs, gate (bs, num_groups, in), weight (num_groups, in, 1) -> (bs, num_groups, 1)
+    # written as one multiply-reduce so that torch.compile fuses the gating and the projection into one kernel
+    return (inputs * gate * weight.squeeze(-1)).sum(dim=-1, keepdim=True)
+
+
+class QuantizedEmbedding(nn.Module):
+    """Inference-only embedding table stored as uint8 (zero point 128) with one float scale per row.
+    Built from a trained nn.Embedding with ``from_float``; lookups dequantize only the gathered rows."""
+    def __init__(self, num_embeddings, embedding_dim, device='cpu'):
+        super(QuantizedEmbedding, self).__init__()
+        self.num_embeddings = num_embeddings
+        self.embedding_dim = embedding_dim
+        self.register_buffer('weight_int8', torch.full((num_embeddings, embedding_dim), 128, dtype=torch.uint8))
+        self.register_buffer('scale', torch.ones(num_embeddings))
+
+        self.to(device)
+
+    @classmethod
+    def from_float(cls, embedding):
+        weight = embedding.weight.detach()
+        quantized = cls(weight.shape[0], weight.shape[1], device=weight.device)
+        # symmetric per-row scale, all-zero rows keep scale 1
+        scale = weight.abs().max(dim=1)[0] / 127
+        scale = torch.where(scale > 0, scale, torch.ones_like(scale))
+        quantized.weight_int8.copy_(torch.round(weight / scale.unsqueeze(-1)) + 128)
+        quantized.scale.copy_(scale)
+        return quantized
+
+    def forward(self, inputs):
+        return (self.weight_int8[inputs].float() - 128) * self.scale[inputs].unsqueeze(-1)
+
+
 class MetaNet(nn.Module):
     """Implements FFN equation."""
     def __init__(self, hidden_dim, dropout=0.1, use_norm=True,meta_dnn_hidden_units=(32,64,32),flag=None):
@@ -369,6 +504,62 @@ class Attention_Layer(nn.Module):
         return result
 
 
+class GroupedAttention_Layer(nn.Module):
+    """Attention_Layer for num_groups tasks at once, each group with its own weights.
+    Input is (bs, num_groups, embedding_size); every group attends over the batch as in Attention_Layer."""
+    def __init__(self, embedding_size, num_groups, head_num=2, use_res=True, scaling=True, seed=1024, device='cpu'):
+        super(GroupedAttention_Layer, self).__init__()
+        if head_num <= 0:
+            raise ValueError('head_num must be a int > 0')
+        if embedding_size % head_num != 0:
+            raise ValueError('embedding_size is not an integer multiple of head_num!')
+        self.att_embedding_size = embedding_size*4
+        self.num_groups = num_groups
+        self.head_num = head_num
+        self.use_res = use_res
+        self.scaling = scaling
+        self.seed = seed
+
+        self.W_Query = nn.Parameter(torch.Tensor(num_groups, embedding_size, self.att_embedding_size))
+        self.W_Key = nn.Parameter(torch.Tensor(num_groups, embedding_size, self.att_embedding_size))
+        self.W_Value = nn.Parameter(torch.Tensor(num_groups, embedding_size, self.att_embedding_size))
+
+        self.output_dnn = GroupedLinear(self.att_embedding_size, embedding_size, num_groups, bias=False)
+
+        self.attn_dropout = nn.Dropout(0.1)
+        self.dropout = nn.Dropout(0.1)
+        # per-group affine parameters of the layer norm
+        self.layer_norm_weight = nn.Parameter(torch.Tensor(num_groups, embedding_size))
+        self.layer_norm_bias = nn.Parameter(torch.Tensor(num_groups, embedding_size))
+
+        for tensor in self.parameters():
+            nn.init.normal_(tensor, mean=0.0, std=0.05)
+
+        self.to(device)
+
+    def forward(self, q,k):
+        q = k
+        v = k
+        # None G D -> G None 4D
+        querys = torch.einsum('bgd,gdh->gbh', q, self.W_Query)
+        keys = torch.einsum('bgd,gdh->gbh', k, self.W_Key)
+        values = torch.einsum('bgd,gdh->gbh', v, self.W_Value)
+
+        inner_product = torch.matmul(querys, keys.transpose(1, 2))  # G None None
+        if self.scaling:
+            inner_product /= self.att_embedding_size ** 0.5
+        self.normalized_att_scores = self.attn_dropout(F.softmax(inner_product, dim=-1))  # G None None
+
+        result = torch.matmul(self.normalized_att_scores, values)  # G None 4D
+        result = self.output_dnn(result.transpose(0, 1))  # None G D
+
+        result = self.dropout(result)
+        result = F.relu(result)
+        result = F.layer_norm(result, result.shape[-1:], eps=1e-6) * self.layer_norm_weight + self.layer_norm_bias
+
+        return result
+
+
 test_visual_ids=[ 1453289, 42966022, 24205824, 16064524, 25503516,  3816928,
         7754202, 16947958, 41552490, 31733916,  9384867, 42806083,
         5328450, 21453215, 34663885, 17948903,  6822311,  1937201,